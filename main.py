@@ -15,9 +15,21 @@ import argparse
 import sys
 from datetime import datetime, timezone
 import os
-from typing import Dict, List, Optional, Any
+import re
+from contextlib import ExitStack
+from operator import itemgetter
+from typing import Dict, Iterable, List, Optional, Any, Tuple, Union
 import traceback
 
+try:
+    # Optional: orjson parses the *_details JSON columns several times faster than the json module
+    import orjson
+    _json_loads = orjson.loads
+    _HAS_ORJSON = True
+except ImportError:
+    _json_loads = json.loads
+    _HAS_ORJSON = False
+
 # --------------------- LOGGING --------------------- #
 
 LOG_FILE = 'data_processing.log'
@@ -60,58 +72,142 @@ def load_config(config_path: Optional[str] = None) -> Dict:
 
 # --------------------- UTILITIES --------------------- #
 
-def parse_custom_datetime(dt_str: Optional[str]) -> Optional[str]:
+# Non-ISO formats accepted by parse_custom_datetime, always interpreted as UTC
+DAY_FIRST_FORMAT = '%d/%m/%y %H:%M'
+ISO_SECONDS_FORMAT = '%Y-%m-%dT%H:%M:%S'
+
+# Common shape of DAY_FIRST_FORMAT ('03/04/23 07:33'), matched without going through strptime
+_DAY_FIRST_RE = re.compile(r'([0-9]{1,2})/([0-9]{1,2})/([0-9]{2}) ([0-9]{1,2}):([0-9]{1,2})')
+
+# Stand-in purchase date for rows without one, so they sort after any real purchase
+FAR_FUTURE = datetime(9999, 12, 31, tzinfo=timezone.utc)
+
+def parse_custom_datetime(dt_str: Union[str, datetime, None]) -> Optional[datetime]:
     if not dt_str:
         return None
+    if isinstance(dt_str, datetime):
+        return dt_str
+    return _parse_datetime(dt_str)
+
+def _parse_datetime(dt_str: str) -> Optional[datetime]:
+    """Parse a non-empty datetime string, trying fromisoformat first for anything that may be ISO 8601."""
+    # Day-first dates ('03/04/23 07:33') never parse as ISO, so send them straight to strptime
+    if '/' in dt_str[:3]:
+        match = _DAY_FIRST_RE.fullmatch(dt_str)
+        if match:
+            day, month, year, hour, minute = map(int, match.groups())
+            try:
+                # Two-digit years pivot like strptime's %y: 69-99 are 19xx, 00-68 are 20xx
+                return datetime(year + (1900 if year >= 69 else 2000), month, day, hour, minute,
+                                tzinfo=timezone.utc)
+            except ValueError:
+                pass
+        try:
+            return datetime.strptime(dt_str, DAY_FIRST_FORMAT).replace(tzinfo=timezone.utc)
+        except ValueError:
+            logger.warning(f"Failed to parse datetime: {dt_str}")
+            return None
+
     try:
         dt = datetime.fromisoformat(dt_str.replace('Z', '+00:00'))
         if dt.tzinfo is None:
             dt = dt.replace(tzinfo=timezone.utc)
     except ValueError:
         try:
-            dt = datetime.strptime(dt_str, '%d/%m/%y %H:%M').replace(tzinfo=timezone.utc)
+            dt = datetime.strptime(dt_str, ISO_SECONDS_FORMAT).replace(tzinfo=timezone.utc)
         except ValueError:
-            try:
-                dt = datetime.strptime(dt_str, '%Y-%m-%dT%H:%M:%S').replace(tzinfo=timezone.utc)
-            except ValueError:
-                logger.warning(f"Failed to parse datetime: {dt_str}")
-                return None
+            logger.warning(f"Failed to parse datetime: {dt_str}")
+            return None
+
+    return dt
+
+# Join keys repeated across the input files; interned so every row shares one string object per id
+INTERNED_FIELDS = frozenset({'user_id', 'branch_id'})
 
-    return dt.isoformat(timespec='milliseconds')
+# Flat {"name": ..., "source": ...} details objects, the common shape in the purchase files.
+# Only JSON whitespace is allowed between tokens, so the regex accepts nothing json.loads would reject
+_FLAT_DETAILS_RE = re.compile(r'\{[ \t\n\r]*"name"[ \t\n\r]*:[ \t\n\r]*"([^"\\\x00-\x1f]*)"[ \t\n\r]*,[ \t\n\r]*"source"[ \t\n\r]*:[ \t\n\r]*"([^"\\\x00-\x1f]*)"[ \t\n\r]*\}')
+
+def parse_details(value: str) -> Any:
+    """Parse a *_details JSON value. Without orjson, flat name/source objects are matched by regex instead."""
+    # The regex beats json.loads by ~2x but is slower than orjson, so it is only used as a stdlib fast path
+    if _HAS_ORJSON:
+        try:
+            return _json_loads(value)
+        except json.JSONDecodeError:
+            # orjson rejects some values json.loads accepts (NaN, Infinity, 1e400, lone surrogates)
+            pass
+    else:
+        match = _FLAT_DETAILS_RE.fullmatch(value)
+        if match:
+            return {"name": match.group(1), "source": match.group(2)}
+    return json.loads(value)
 
 # --------------------- CSV HANDLING --------------------- #
 
-def read_csv(file_path: str, datetime_fields: Optional[List[str]] = None) -> List[Dict]:
-    """Read a CSV file and return a list of dictionaries, handling datetime fields and JSON columns."""
+# Buffer size for CSV files, far larger than the 8 KiB default to cut read/write syscalls on big tables
+IO_BUFFER_SIZE = 1 << 20
+
+def read_csv(file_path: str, datetime_fields: Optional[List[str]] = None, columns: Optional[List[str]] = None) -> List[Dict]:
+    """
+    Read a CSV file and return a list of dictionaries, handling datetime fields and JSON columns.
+    If columns is given, only those columns are cleaned, converted and kept in each row.
+    """
     data = []
     if not os.path.exists(file_path):
         logger.warning(f"File not found: {file_path}")
         return data
 
+    datetime_fields = frozenset(datetime_fields or ())
     try:
-        with open(file_path, 'r', encoding='utf-8') as file:
-            reader = csv.DictReader(file, quotechar='"', escapechar='\\')
+        with open(file_path, 'r', newline='', encoding='utf-8', buffering=IO_BUFFER_SIZE) as file:
+            reader = csv.reader(file, quotechar='"', escapechar='\\')
+            header = next(reader, [])
+            width = len(header)
+            detail_fields = frozenset(f for f in header if f and f.endswith('_details'))
+
+            # Resolve every output column to its position and conversion once; like DictReader,
+            # a repeated header keeps its last column
+            position = {name: i for i, name in enumerate(header)}
+            plan = []
+            for key in (columns or position):
+                if key in INTERNED_FIELDS:
+                    kind = 'intern'
+                elif key in datetime_fields:
+                    kind = 'datetime'
+                elif key in detail_fields:
+                    kind = 'details'
+                else:
+                    kind = None
+                plan.append((key, position.get(key), kind))
+
             for row in reader:
-                # Clean whitespace
-                cleaned = {k: (v.strip() if isinstance(v, str) else v) for k, v in row.items()}
-
-                # Parse datetime fields
-                if datetime_fields:
-                    for field in datetime_fields:
-                        if field in cleaned and cleaned[field]:
-                            dt = parse_custom_datetime(cleaned[field])
-                            if dt:
-                                cleaned[field] = dt
-                                                               
-                # Parse *_details JSON fields
-                for key, value in cleaned.items():
-                    if key and key.endswith('_details') and value:
-                        try:
-                            if isinstance(value, str):
-                                cleaned[key] = json.loads(value)
-                        except json.JSONDecodeError:
-                            logger.warning(f"Failed to parse JSON in field '{key}': {value}")
-                            cleaned[key] = {}
+                if not row:
+                    continue
+                if len(row) < width:
+                    row += [None] * (width - len(row))
+
+                # Clean whitespace and convert datetime / *_details JSON fields in a single pass
+                cleaned = {}
+                for key, i, kind in plan:
+                    value = row[i] if i is not None else None
+                    if isinstance(value, str):
+                        value = value.strip()
+                        if kind == 'intern':
+                            value = sys.intern(value)
+                        elif kind == 'datetime' and value:
+                            value = _parse_datetime(value) or value
+                        elif kind == 'details' and value:
+                            try:
+                                value = parse_details(value)
+                            except json.JSONDecodeError:
+                                logger.warning(f"Failed to parse JSON in field '{key}': {value}")
+                                value = {}
+                    cleaned[key] = value
+
+                # Extra cells beyond the header are kept under None, as csv.DictReader does
+                if columns is None and len(row) > width:
+                    cleaned[None] = row[width:]
 
                 data.append(cleaned)
 
@@ -122,19 +218,44 @@ def read_csv(file_path: str, datetime_fields: Optional[List[str]] = None) -> Lis
 
     return data
 
-def write_csv(data: List[Dict], file_path: str, fieldnames: List[str]) -> bool:
+def _format_value(value: Any) -> Any:
+    """Serialize a datetime value for CSV output, leaving anything else as is."""
+    return value.isoformat(timespec='milliseconds') if isinstance(value, datetime) else value
+
+def _format_row(row: Dict) -> Dict:
+    """Serialize datetime values for CSV output, copying the row only if it holds any."""
+    formatted = None
+    for key, value in row.items():
+        if isinstance(value, datetime):
+            if formatted is None:
+                formatted = dict(row)
+            formatted[key] = value.isoformat(timespec='milliseconds')
+    return row if formatted is None else formatted
+
+def write_csv(data: Iterable[Dict], file_path: str, fieldnames: List[str]) -> bool:
     try:
         os.makedirs(os.path.dirname(file_path), exist_ok=True)
-        with open(file_path, 'w', newline='', encoding='utf-8') as f:
-            writer = csv.DictWriter(f, fieldnames=fieldnames)
-            writer.writeheader()
+        with open(file_path, 'w', newline='', encoding='utf-8', buffering=IO_BUFFER_SIZE) as f:
+            dict_writer = csv.DictWriter(f, fieldnames=fieldnames)
+            dict_writer.writeheader()
+
+            # Rows holding exactly the fieldnames are written as plain value lists; anything else
+            # (missing or extra keys) goes through DictWriter, which fills in or rejects them
+            writer = dict_writer.writer
+            width = len(fieldnames)
+            values = itemgetter(*fieldnames) if width > 1 else None
+            count = 0
             for row in data:
-                formatted_row = {
-                    k: (v.isoformat(timespec='milliseconds') if isinstance(v, datetime) else v)
-                    for k, v in row.items()
-                }
-                writer.writerow(formatted_row)
-        logger.info(f"Saved {len(data)} rows to {file_path}")
+                regular = values is not None and len(row) == width
+                if regular:
+                    try:
+                        writer.writerow(map(_format_value, values(row)))
+                    except KeyError:
+                        regular = False
+                if not regular:
+                    dict_writer.writerow(_format_row(row))
+                count += 1
+        logger.info(f"Saved {count} rows to {file_path}")
         return True
     except Exception as e:
         logger.error(f"Failed to write CSV: {e}")
@@ -143,188 +264,225 @@ def write_csv(data: List[Dict], file_path: str, fieldnames: List[str]) -> bool:
 
 # --------------------- PROCESSING FUNCTIONS --------------------- #
 
-def process_credit_packs(data: List[Dict]) -> Dict[str, Dict]:
+# Output columns, in order, for the client conversion events and lead conversions files
+CLIENT_EVENT_FIELDS = [
+    'user_id', 'branch_id', 'local_user_created_at', 'lead_status',
+    'client_conversion_event_type', 'client_conversion_event_id',
+    'client_conversion_event_local_created_at', 'client_conversion_event_name',
+    'client_conversion_event_source', 'first_user_membership_id',
+    'first_local_membership_purchased_at', 'first_membership_name',
+    'first_membership_source', 'first_credit_pack_id',
+    'first_local_credit_pack_purchased_at', 'first_credit_pack_name',
+    'first_credit_pack_source'
+]
+LEAD_CONVERSION_FIELDS = CLIENT_EVENT_FIELDS + ['client_conversion_event_filter']
+
+def _earliest_purchase_per_user(data: List[Dict], prefix: str, label: str) -> Dict[str, Dict]:
     """
-    Process credit pack purchase data to find the earliest credit pack purchase for each user.
-    Assumes credit_pack_purchase_details is a valid JSON object already parsed in read_csv().
+    Shared reduction behind process_credit_packs() and process_memberships(): keep the earliest
+    purchase row per user, with the name/source from {prefix}_purchase_details copied onto the row.
+    Name/source are only extracted for the kept rows, once the earliest purchase per user is known.
     """
-    result = {}
+    id_field = f'{prefix}_id'
+    date_field = f'{prefix}_purchased_at'
+    details_field = f'{prefix}_purchase_details'
+    name_field = f'{prefix}_name'
+    source_field = f'{prefix}_source'
+
+    earliest = {}  # user_id -> (parsed purchase date, row)
     for row in data:
         user_id = row.get("user_id")
-        if not user_id or not row.get("credit_pack_id"):
-            logger.debug(f"Skipping credit pack record for user {user_id} - missing credit_pack_id")
+        if not user_id or not row.get(id_field):
+            logger.debug(f"Skipping {label} record for user {user_id} - missing {id_field}")
             continue
 
-        # Extract name and source from pre-parsed JSON
-        details = row.get('credit_pack_purchase_details', {})
-        name = details.get('name') if isinstance(details, dict) else None
-        source = details.get('source') if isinstance(details, dict) else None
-
-        # Update row with extracted values
-        row['credit_pack_name'] = name
-        row['credit_pack_source'] = source
-        row['credit_pack_purchase_details'] = {"name": name, "source": source}
-        
         # Handle missing purchase date
-        purchase_date_str = row.get('credit_pack_purchased_at') or '9999-12-31T00:00:00Z'
-        row['credit_pack_purchased_at'] = purchase_date_str
-        logger.debug(f"Missing purchase date for user {user_id} credit pack - using future date")
+        purchase_date = row.get(date_field)
+        if not purchase_date:
+            logger.debug(f"Missing purchase date for user {user_id} {label} - using future date")
+            purchase_date = FAR_FUTURE
+        row[date_field] = purchase_date
+
+        # Compare and store earliest purchase per user, keeping its parsed date next to the row
+        new_date = parse_custom_datetime(purchase_date)
+        current = earliest.get(user_id)
+        if current is None or (new_date and current[0] and new_date < current[0]):
+            earliest[user_id] = (new_date, row)
+
+    # Extract name and source from pre-parsed JSON, only for the rows that were kept
+    result = {}
+    for user_id, (_, row) in earliest.items():
+        details = row.get(details_field, {})
+        if isinstance(details, dict):
+            name = details.get('name')
+            source = details.get('source')
+        else:
+            name = source = None
+
+        # Names and sources take a handful of distinct values; intern them so kept rows share one string each
+        if isinstance(name, str):
+            name = sys.intern(name)
+        if isinstance(source, str):
+            source = sys.intern(source)
 
-        # Compare and store earliest purchase per user
-        current_date = parse_custom_datetime(result.get(user_id, {}).get('credit_pack_purchased_at', '9999-12-31'))
-        new_date = parse_custom_datetime(purchase_date_str)
+        # Update row with extracted values
+        row[name_field] = name
+        row[source_field] = source
+        row[details_field] = {"name": name, "source": source}
+        result[user_id] = row
 
-        if user_id not in result or (new_date and current_date and new_date < current_date):
-            result[user_id] = row
+    return result
 
+def process_credit_packs(data: List[Dict]) -> Dict[str, Dict]:
+    """
+    Process credit pack purchase data to find the earliest credit pack purchase for each user.
+    Assumes credit_pack_purchase_details is a valid JSON object already parsed in read_csv().
+    """
+    result = _earliest_purchase_per_user(data, 'credit_pack', 'credit pack')
     logger.info(f"Processed credit packs: found {len(result)} unique users with credit pack purchases")
     return result
 
 def process_memberships(data: List[Dict]) -> Dict[str, Dict]:
     """
-   Process membership purchase data to find the earliest membership purchase for each user.
-   Assumes membership_purchase_details is a valid JSON object already parsed in read_csv().
-   """
-    result = {}
-    for row in data:
-        user_id = row.get("user_id")
-        if not user_id or not row.get("membership_id"):
-            continue
+    Process membership purchase data to find the earliest membership purchase for each user.
+    Assumes membership_purchase_details is a valid JSON object already parsed in read_csv().
+    """
+    result = _earliest_purchase_per_user(data, 'membership', 'membership')
+    logger.info(f"Processed memberships: found {len(result)} unique users with membership purchases")
+    return result
 
-         # Extract name and source from pre-parsed JSON
-        details = row.get('membership_purchase_details', {})
-        name = details.get('name') if isinstance(details, dict) else None
-        source = details.get('source') if isinstance(details, dict) else None
+def _first_conversion_type(has_credit: bool, has_membership: bool,
+                           credit_at: Any, membership_at: Any) -> Optional[str]:
+    """
+    Return the conversion type that happened first: 'USER_CREDIT' (ties included) or 'MEMBERSHIP'.
+    With both purchases present the dates decide, and None is returned if either cannot be parsed.
+    """
+    if has_credit and has_membership:
+        credit_time = parse_custom_datetime(credit_at)
+        membership_time = parse_custom_datetime(membership_at)
+        if not (credit_time and membership_time):
+            return None
+        return 'USER_CREDIT' if credit_time <= membership_time else 'MEMBERSHIP'
+    return 'USER_CREDIT' if has_credit else 'MEMBERSHIP' if has_membership else None
+
+def _client_conversion_fields(user: Dict, credits: Dict[str, Dict], memberships: Dict[str, Dict]) -> Optional[Tuple]:
+    """
+    Resolve a single user's conversion, or None if the user has no user_id.
+    Returns (user_fields, conversion_type, membership_fields, credit_fields), where user_fields is
+    (user_id, branch_id, created_at, lead_status) and each *_fields purchase tuple is
+    (id, purchased_at, name, source), all None when there is no such purchase.
+    """
+    user_id = user.get('user_id')
+    if not user_id:
+        return None
 
-        # Update row with extracted values
-        row['membership_name'] = name
-        row['membership_source'] = source
-        row['membership_purchase_details'] = {"name": name, "source": source}
+    # First credit pack and membership details, None when there is no such purchase
+    credit = credits.get(user_id)
+    if credit is not None:
+        credit_fields = (credit.get('credit_pack_id'), credit.get('credit_pack_purchased_at'),
+                         credit.get('credit_pack_name'), credit.get('credit_pack_source'))
+    else:
+        credit_fields = (None, None, None, None)
 
-        # Handle missing purchase date
-        purchase_date_str = row.get('membership_purchased_at') or '9999-12-31T00:00:00Z'
-        row['membership_purchased_at'] = purchase_date_str
-        logger.debug(f"Missing purchase date for user {user_id} membership - using future date")
+    membership = memberships.get(user_id)
+    if membership is not None:
+        membership_fields = (membership.get('membership_id'), membership.get('membership_purchased_at'),
+                             membership.get('membership_name'), membership.get('membership_source'))
+    else:
+        membership_fields = (None, None, None, None)
 
-        # Compare and store earliest purchase per user
-        current_date = parse_custom_datetime(result.get(user_id, {}).get('membership_purchased_at', '9999-12-31'))
-        new_date = parse_custom_datetime(purchase_date_str)
+    # Determine which event happened first; its fields become the client_conversion_ fields
+    conversion_type = _first_conversion_type(credit is not None, membership is not None,
+                                             credit_fields[1], membership_fields[1])
 
-        if user_id not in result or (new_date and current_date and new_date < current_date):
-            result[user_id] = row
+    # A user with either a membership or a credit pack is a CLIENT
+    lead_status = 'CLIENT' if credit is not None or membership is not None else 'LEAD'
+    user_fields = (user_id, user.get('branch_id'), user.get('created_at'), lead_status)
+    return user_fields, conversion_type, membership_fields, credit_fields
 
-    logger.info(f"Processed memberships: found {len(result)} unique users with membership purchases")
-    return result
+def _conversion_fields(conversion_type: Optional[str], membership_fields: Tuple, credit_fields: Tuple) -> Tuple:
+    """Return the purchase fields of whichever purchase came first, all None without a conversion."""
+    if conversion_type == 'USER_CREDIT':
+        return credit_fields
+    if conversion_type == 'MEMBERSHIP':
+        return membership_fields
+    return (None, None, None, None)
 
 def create_client_conversion_events(users: List[Dict], credits: Dict[str, Dict], memberships: Dict[str, Dict]) -> List[Dict]:
     """
     Create client conversion events by combining user, credit pack, and membership data.
     Fields prefixed with client_conversion_ should contain details of either the first credit 
     pack or membership depending on which was purchased first.
+    The full pipeline streams the same rows to disk with write_conversions() instead.
     """
     results = []
     for user in users:
-        user_id = user.get('user_id')
-        if not user_id:
+        resolved = _client_conversion_fields(user, credits, memberships)
+        if resolved is None:
             continue
-
-        # Initialize the event with default values
-        event = {
-            'user_id': user_id,
-            'branch_id': user.get('branch_id'),
-            'local_user_created_at': user.get('created_at'),
-            'lead_status': 'LEAD',
-            'client_conversion_event_type': None,
-            'client_conversion_event_id': None,
-            'client_conversion_event_local_created_at': None,
-            'client_conversion_event_name': None,
-            'client_conversion_event_source': None,
-            'first_user_membership_id': None,
-            'first_local_membership_purchased_at': None,
-            'first_membership_name': None,
-            'first_membership_source': None,
-            'first_credit_pack_id': None,
-            'first_local_credit_pack_purchased_at': None,
-            'first_credit_pack_name': None,
-            'first_credit_pack_source': None
-        }
-
-        # Add credit pack data if available
-        has_credit = False
-        if user_id in credits:
-            credit = credits[user_id]
-            has_credit = True
-            event.update({
-                'first_credit_pack_id': credit.get('credit_pack_id'),
-                'first_local_credit_pack_purchased_at': credit.get('credit_pack_purchased_at'),
-                'first_credit_pack_name': credit.get('credit_pack_name'),
-                'first_credit_pack_source': credit.get('credit_pack_source')
-            })
-
-        # Add membership data if available
-        has_membership = False
-        if user_id in memberships:
-            membership = memberships[user_id]
-            has_membership = True
-            event.update({
-                'first_user_membership_id': membership.get('membership_id'),
-                'first_local_membership_purchased_at': membership.get('membership_purchased_at'),
-                'first_membership_name': membership.get('membership_name'),
-                'first_membership_source': membership.get('membership_source')
-            })
-
-        # Determine which event happened first and set conversion event fields
-        # First check if either event exists at all
-        if has_credit or has_membership:
-            # Default to setting lead_status to CLIENT since they have either membership or credit
-            event['lead_status'] = 'CLIENT'
-
-            credit_time = parse_custom_datetime(event.get('first_local_credit_pack_purchased_at'))
-            membership_time = parse_custom_datetime(event.get('first_local_membership_purchased_at'))
-
-            if has_credit and has_membership:
-                # Both exist, determine which came first
-                if credit_time and membership_time:
-                    if credit_time <= membership_time:
-                        event.update({
-                            'client_conversion_event_type': 'USER_CREDIT',
-                            'client_conversion_event_id': event['first_credit_pack_id'],
-                            'client_conversion_event_local_created_at': event['first_local_credit_pack_purchased_at'],
-                            'client_conversion_event_name': event['first_credit_pack_name'],
-                            'client_conversion_event_source': event['first_credit_pack_source']
-                        })
-                    else:
-                        event.update({
-                            'client_conversion_event_type': 'MEMBERSHIP',
-                            'client_conversion_event_id': event['first_user_membership_id'],
-                            'client_conversion_event_local_created_at': event['first_local_membership_purchased_at'],
-                            'client_conversion_event_name': event['first_membership_name'],
-                            'client_conversion_event_source': event['first_membership_source']
-                        })
-            elif has_credit:
-                event.update({
-                    'client_conversion_event_type': 'USER_CREDIT',
-                    'client_conversion_event_id': event['first_credit_pack_id'],
-                    'client_conversion_event_local_created_at': event['first_local_credit_pack_purchased_at'],
-                    'client_conversion_event_name': event['first_credit_pack_name'],
-                    'client_conversion_event_source': event['first_credit_pack_source']
-                })
-            elif has_membership:
-                event.update({
-                    'client_conversion_event_type': 'MEMBERSHIP',
-                    'client_conversion_event_id': event['first_user_membership_id'],
-                    'client_conversion_event_local_created_at': event['first_local_membership_purchased_at'],
-                    'client_conversion_event_name': event['first_membership_name'],
-                    'client_conversion_event_source': event['first_membership_source']
-                })
-
-        results.append(event)
+        user_fields, conversion_type, membership_fields, credit_fields = resolved
+        conversion_fields = _conversion_fields(conversion_type, membership_fields, credit_fields)
+        results.append(dict(zip(CLIENT_EVENT_FIELDS, (*user_fields, conversion_type, *conversion_fields,
+                                                      *membership_fields, *credit_fields))))
 
     # Count the number of clients found
     client_count = sum(1 for event in results if event['lead_status'] == 'CLIENT')
     logger.info(f"Created {len(results)} client conversion events ({client_count} CLIENTs, {len(results) - client_count} LEADs)")
     return results
 
+def _lead_conversion_records(event: Dict) -> List[Dict]:
+    """Build the MEMBERSHIP / USER_CREDIT / ALL lead conversion records for a single client conversion event."""
+    # Skip if not a client (no conversion happened)
+    if event.get('lead_status') != 'CLIENT':
+        return []
+
+    membership_id = event.get('first_user_membership_id')
+    credit_id = event.get('first_credit_pack_id')
+    has_membership = membership_id is not None
+    has_credit = credit_id is not None
+
+    if not has_membership and not has_credit:
+        return [] # Skip if no conversion info available
+
+    # Event type for ALL record - whichever event came first
+    all_event_type = _first_conversion_type(has_credit, has_membership,
+                                            event.get('first_local_credit_pack_purchased_at'),
+                                            event.get('first_local_membership_purchased_at'))
+
+    # Conversion fields for each event type, built once and shared by its own record and the ALL record
+    membership_fields = {
+        'client_conversion_event_type': 'MEMBERSHIP',
+        'client_conversion_event_id': membership_id,
+        'client_conversion_event_local_created_at': event['first_local_membership_purchased_at'],
+        'client_conversion_event_name': event['first_membership_name'],
+        'client_conversion_event_source': event['first_membership_source']
+    } if has_membership else None
+    credit_fields = {
+        'client_conversion_event_type': 'USER_CREDIT',
+        'client_conversion_event_id': credit_id,
+        'client_conversion_event_local_created_at': event['first_local_credit_pack_purchased_at'],
+        'client_conversion_event_name': event['first_credit_pack_name'],
+        'client_conversion_event_source': event['first_credit_pack_source']
+    } if has_credit else None
+
+    records = []
+
+    # Create MEMBERSHIP record if applicable
+    if has_membership:
+        records.append({**event, **membership_fields, 'client_conversion_event_filter': 'MEMBERSHIP'})
+
+    # Create USER_CREDIT record if applicable
+    if has_credit:
+        records.append({**event, **credit_fields, 'client_conversion_event_filter': 'USER_CREDIT'})
+
+    # Create ALL record with the earliest conversion type
+    if all_event_type == 'MEMBERSHIP':
+        records.append({**event, **membership_fields, 'client_conversion_event_filter': 'ALL'})
+    elif all_event_type == 'USER_CREDIT':
+        records.append({**event, **credit_fields, 'client_conversion_event_filter': 'ALL'})
+
+    return records
+
 def create_lead_conversions(events: List[Dict]) -> List[Dict]:
     """
     Create lead conversion records based on client conversion events.
@@ -338,86 +496,93 @@ def create_lead_conversions(events: List[Dict]) -> List[Dict]:
 
     records = []
     for event in events:
-        # Skip if not a client (no conversion happened)
-        if event.get('lead_status') != 'CLIENT':
-            continue
+        records.extend(_lead_conversion_records(event))
+
+    _log_lead_conversion_counts(records)
+    return records
 
-        has_membership = event.get('first_user_membership_id') is not None
-        has_credit = event.get('first_credit_pack_id') is not None
-
-        if not has_membership and not has_credit:
-            continue # Skip if no conversion info available
-
-        membership_dt = parse_custom_datetime(event.get('first_local_membership_purchased_at'))
-        credit_dt = parse_custom_datetime(event.get('first_local_credit_pack_purchased_at'))
-
-        # Event type for ALL record - whichever event came first
-        all_event_type = None
-        if has_membership and has_credit:
-            if credit_dt and membership_dt:
-                all_event_type = 'USER_CREDIT' if credit_dt <= membership_dt else 'MEMBERSHIP'
-        elif has_membership:
-            all_event_type = 'MEMBERSHIP'
-        elif has_credit:
-            all_event_type = 'USER_CREDIT'
-
-        # Create MEMBERSHIP record if applicable
-        if has_membership:
-            membership_record = event.copy()
-            membership_record.update({
-                'client_conversion_event_type': 'MEMBERSHIP',
-                'client_conversion_event_id': event['first_user_membership_id'],
-                'client_conversion_event_local_created_at': event['first_local_membership_purchased_at'],
-                'client_conversion_event_name': event['first_membership_name'],
-                'client_conversion_event_source': event['first_membership_source'],
-                'client_conversion_event_filter': 'MEMBERSHIP'
-            })
-            records.append(membership_record)
-
-        # Create USER_CREDIT record if applicable
-        if has_credit:
-            credit_record = event.copy()
-            credit_record.update({
-                'client_conversion_event_type': 'USER_CREDIT',
-                'client_conversion_event_id': event['first_credit_pack_id'],
-                'client_conversion_event_local_created_at': event['first_local_credit_pack_purchased_at'],
-                'client_conversion_event_name': event['first_credit_pack_name'],
-                'client_conversion_event_source': event['first_credit_pack_source'],
-                'client_conversion_event_filter': 'USER_CREDIT'
-            })
-            records.append(credit_record)
-
-        # Create ALL record with the earliest conversion type
-        if all_event_type == 'MEMBERSHIP':
-            all_record = event.copy()
-            all_record.update({
-                'client_conversion_event_type': 'MEMBERSHIP',
-                'client_conversion_event_id': event['first_user_membership_id'],
-                'client_conversion_event_local_created_at': event['first_local_membership_purchased_at'],
-                'client_conversion_event_name': event['first_membership_name'],
-                'client_conversion_event_source': event['first_membership_source'],
-                'client_conversion_event_filter': 'ALL'
-            })
-            records.append(all_record)
-        elif all_event_type == 'USER_CREDIT':
-            all_record = event.copy()
-            all_record.update({
-                'client_conversion_event_type': 'USER_CREDIT',
-                'client_conversion_event_id': event['first_credit_pack_id'],
-                'client_conversion_event_local_created_at': event['first_local_credit_pack_purchased_at'],
-                'client_conversion_event_name': event['first_credit_pack_name'],
-                'client_conversion_event_source': event['first_credit_pack_source'],
-                'client_conversion_event_filter': 'ALL'
-            })
-            records.append(all_record)
-
-    # # Count records by filter type
+def write_conversions(users: Iterable[Dict], credits: Dict[str, Dict], memberships: Dict[str, Dict],
+                      events_path: str, leads_path: str) -> int:
+    """
+    Create client conversion events and their lead conversion records in a single pass over users,
+    writing each row to its CSV file as soon as it is built instead of collecting them in lists.
+    Rows are written as tuples laid out as CLIENT_EVENT_FIELDS / LEAD_CONVERSION_FIELDS, so a
+    user's event and lead records share the same formatted field values without building dicts.
+    The lead conversions file is only created once there is a record to write.
+    Returns the number of lead conversion records written. Write errors are raised rather than
+    logged, so a failed Part 1 is never mistaken for one that produced no lead conversions.
+    """
+    event_count = client_count = 0
+    filter_counts = {'MEMBERSHIP': 0, 'USER_CREDIT': 0, 'ALL': 0}
+    os.makedirs(os.path.dirname(events_path), exist_ok=True)
+    os.makedirs(os.path.dirname(leads_path), exist_ok=True)
+    with ExitStack() as stack:
+        events_file = stack.enter_context(open(events_path, 'w', newline='', encoding='utf-8', buffering=IO_BUFFER_SIZE))
+        event_writer = csv.writer(events_file)
+        event_writer.writerow(CLIENT_EVENT_FIELDS)
+        lead_writer = None
+
+        for user in users:
+            resolved = _client_conversion_fields(user, credits, memberships)
+            if resolved is None:
+                continue
+            user_fields, conversion_type, membership_fields, credit_fields = resolved
+            user_id, branch_id, created_at, lead_status = user_fields
+
+            # Format each datetime once; the event and all its lead records reuse the strings
+            user_fields = (user_id, branch_id, _format_value(created_at), lead_status)
+            membership_fields = tuple(map(_format_value, membership_fields))
+            credit_fields = tuple(map(_format_value, credit_fields))
+            first_fields = membership_fields + credit_fields
+
+            conversion_fields = _conversion_fields(conversion_type, membership_fields, credit_fields)
+            event_writer.writerow((*user_fields, conversion_type, *conversion_fields, *first_fields))
+            event_count += 1
+
+            # Only CLIENTs have lead conversions: MEMBERSHIP / USER_CREDIT for each purchase made,
+            # plus ALL for whichever came first. A CLIENT always has at least one of the two
+            if lead_status != 'CLIENT':
+                continue
+            client_count += 1
+            has_membership = membership_fields[0] is not None
+            has_credit = credit_fields[0] is not None
+
+            if lead_writer is None:
+                leads_file = stack.enter_context(open(leads_path, 'w', newline='', encoding='utf-8', buffering=IO_BUFFER_SIZE))
+                lead_writer = csv.writer(leads_file)
+                lead_writer.writerow(LEAD_CONVERSION_FIELDS)
+
+            membership_row = (*user_fields, 'MEMBERSHIP', *membership_fields, *first_fields) if has_membership else None
+            credit_row = (*user_fields, 'USER_CREDIT', *credit_fields, *first_fields) if has_credit else None
+            if has_membership:
+                lead_writer.writerow(membership_row + ('MEMBERSHIP',))
+                filter_counts['MEMBERSHIP'] += 1
+            if has_credit:
+                lead_writer.writerow(credit_row + ('USER_CREDIT',))
+                filter_counts['USER_CREDIT'] += 1
+            if conversion_type == 'MEMBERSHIP':
+                lead_writer.writerow(membership_row + ('ALL',))
+                filter_counts['ALL'] += 1
+            elif conversion_type == 'USER_CREDIT':
+                lead_writer.writerow(credit_row + ('ALL',))
+                filter_counts['ALL'] += 1
+
+    lead_count = sum(filter_counts.values())
+    logger.info(f"Created {event_count} client conversion events ({client_count} CLIENTs, {event_count - client_count} LEADs)")
+    logger.info(f"Created {lead_count} lead conversion records ({filter_counts['MEMBERSHIP']} MEMBERSHIP, "
+                f"{filter_counts['USER_CREDIT']} USER_CREDIT, {filter_counts['ALL']} ALL)")
+    logger.info(f"Saved {event_count} rows to {events_path}")
+    if lead_count:
+        logger.info(f"Saved {lead_count} rows to {leads_path}")
+    return lead_count
+
+def _log_lead_conversion_counts(records: List[Dict]) -> None:
+    # Count records by filter type
     membership_count = sum(1 for r in records if r['client_conversion_event_filter'] == 'MEMBERSHIP')
     credit_count = sum(1 for r in records if r['client_conversion_event_filter'] == 'USER_CREDIT')
     all_count = sum(1 for r in records if r['client_conversion_event_filter'] == 'ALL')
 
     logger.info(f"Created {len(records)} lead conversion records ({membership_count} MEMBERSHIP, {credit_count} USER_CREDIT, {all_count} ALL)")
-    return records
 
 def read_conversion_events_part2(path: str) -> List[Dict]:
     """
@@ -428,20 +593,12 @@ def read_conversion_events_part2(path: str) -> List[Dict]:
         logger.warning(f"File not found: {path}")
         return []
 
-    expected_fields = [
-        'user_id','branch_id','local_user_created_at','lead_status','client_conversion_event_type',
-        'client_conversion_event_id','client_conversion_event_local_created_at','client_conversion_event_name',
-        'client_conversion_event_source','first_user_membership_id','first_local_membership_purchased_at',
-        'first_membership_name','first_membership_source','first_credit_pack_id','first_local_credit_pack_purchased_at',
-        'first_credit_pack_name','first_credit_pack_source'
-    ]
-
     try:
-        with open(path, 'r', encoding='utf-8') as f:
+        with open(path, 'r', newline='', encoding='utf-8', buffering=IO_BUFFER_SIZE) as f:
             first_line = f.readline().strip()
             f.seek(0)
             has_header = 'user_id' in first_line
-            reader = csv.DictReader(f, fieldnames=None if has_header else expected_fields)
+            reader = csv.DictReader(f, fieldnames=None if has_header else CLIENT_EVENT_FIELDS)
             data = list(reader)
             logger.info(f"Loaded {len(data)} rows from {path}")
             return data
@@ -479,62 +636,38 @@ def main():
     # Full pipeline - Part 1 and Part 2
     logger.info("Running full pipeline (Part 1 and Part 2)")
 
-    # Load data
-    #users = read_csv(input_paths['dim_user'])
-    users = read_csv(input_paths['dim_user'], ['created_at'])
-    credit_data = read_csv(input_paths['fct_credit_pack_purchases'], ['credit_pack_purchased_at'])
-    membership_data = read_csv(input_paths['fct_membership_purchases'], ['membership_purchased_at'])
-
-    # Process Part 1: conversion events
-    credits = process_credit_packs(credit_data)
-    memberships = process_memberships(membership_data)
-    client_events = create_client_conversion_events(users, credits, memberships)
-
-    # Process Part 2: lead conversions from Part 1 output
-    lead_conversions = create_lead_conversions(client_events)
+    # Load data, keeping only the columns used downstream. Each purchase file is reduced to the
+    # earliest purchase per user as soon as it is read, so its raw rows are released before the next load
+    credits = process_credit_packs(read_csv(input_paths['fct_credit_pack_purchases'], ['credit_pack_purchased_at'],
+                                            ['user_id', 'credit_pack_id', 'credit_pack_purchased_at', 'credit_pack_purchase_details']))
+    memberships = process_memberships(read_csv(input_paths['fct_membership_purchases'], ['membership_purchased_at'],
+                                               ['user_id', 'membership_id', 'membership_purchased_at', 'membership_purchase_details']))
+    users = read_csv(input_paths['dim_user'], ['created_at'],
+                     ['user_id', 'branch_id', 'created_at'])
+
+    # Process Part 1 and Part 2 together, streaming conversion events and their lead conversions
+    # to the output files in one pass
+    lead_count = write_conversions(users, credits, memberships,
+                                   output_paths['fct_client_conversion_events'],
+                                   output_paths['fct_lead_conversions'])
+
+    if lead_count:
+        logger.info(f"Lead conversions generated from Part 1: {lead_count}")
+        print(f"Generated {lead_count} lead conversions from Part 1")
+        return
 
-    if lead_conversions:
-        logger.info(f"Lead conversions generated from Part 1: {len(lead_conversions)}")
-        print(f"Generated {len(lead_conversions)} lead conversions from Part 1")
+    logger.warning("No lead conversions found from Part 1 — falling back to pre-generated part 2 data")
+    fallback_events = read_conversion_events_part2(input_paths['fct_client_conversion_events_part_2'])
+    lead_conversions = []
+    if fallback_events:
+        lead_conversions = create_lead_conversions(fallback_events)
+        logger.info(f"Loaded and created {len(lead_conversions)} lead conversions from fallback file")
     else:
-        logger.warning("No lead conversions found from Part 1 — falling back to pre-generated part 2 data")
-        fallback_events = read_conversion_events_part2(input_paths['fct_client_conversion_events_part_2'])
-        if fallback_events:
-            lead_conversions = create_lead_conversions(fallback_events)
-            logger.info(f"Loaded and created {len(lead_conversions)} lead conversions from fallback file")
-        else:
-            logger.error("Fallback file is missing or empty")
-
-    # Define field lists
-    client_event_fields = [
-    'user_id', 'branch_id', 'local_user_created_at', 'lead_status',
-    'client_conversion_event_type', 'client_conversion_event_id',
-    'client_conversion_event_local_created_at', 'client_conversion_event_name',
-    'client_conversion_event_source', 'first_user_membership_id',
-    'first_local_membership_purchased_at', 'first_membership_name',
-    'first_membership_source', 'first_credit_pack_id',
-    'first_local_credit_pack_purchased_at', 'first_credit_pack_name',
-    'first_credit_pack_source'
-    ]
-    
-    lead_conversion_fields = client_event_fields + ['client_conversion_event_filter']
-    
-    # Use actual fields from data if available
-    if client_events:
-        client_event_fields = list(client_events[0].keys())
-    if lead_conversions:
-        lead_conversion_fields = list(lead_conversions[0].keys())
-
-    # Ensure output directories exist
-    os.makedirs(os.path.dirname(output_paths['fct_client_conversion_events']), exist_ok=True)
-    os.makedirs(os.path.dirname(output_paths['fct_lead_conversions']), exist_ok=True)
-
-    # Write Part 1 output
-    write_csv(client_events, output_paths['fct_client_conversion_events'], client_event_fields)
+        logger.error("Fallback file is missing or empty")
 
     # Write Part 2 output
     if lead_conversions:
-        write_csv(lead_conversions, output_paths['fct_lead_conversions'], lead_conversion_fields)
+        write_csv(lead_conversions, output_paths['fct_lead_conversions'], list(lead_conversions[0].keys()))
     else:
         logger.warning("No lead conversions data to write")
        